@@ -25,7 +25,7 @@ gst-launch-1.0 libcamerasrc camera-name='\_SB_.PC00.I2C3.CAMF' \
     ! queue \
     ! video/x-raw,width=1280,height=720,framerate=30/1 \
     ! videoflip method=rotate-180 \
-    ! videoconvert \
+    ! videoconvert n-threads=$(nproc) \
     ! video/x-raw,format=YUY2 \
     ! v4l2sink device=/dev/video10 >/tmp/cam_front.log 2>&1 &
 PID_FRONT=$!
@@ -38,7 +38,7 @@ gst-launch-1.0 libcamerasrc camera-name='\_SB_.PC00.I2C2.CAMR' \
     ! queue \
     ! video/x-raw,width=1280,height=720,framerate=30/1 \
     ! videoflip method=rotate-180 \
-    ! videoconvert \
+    ! videoconvert n-threads=$(nproc) \
     ! video/x-raw,format=YUY2 \
     ! v4l2sink device=/dev/video11 >/tmp/cam_rear.log 2>&1 &
 PID_REAR=$!
@@ -52,12 +52,19 @@ if ! python3 -c "import gi" 2>/dev/null; then
 else
     echo "✓ Python dependencies already installed"
 fi
+if ! python3 -c "import numpy, cv2" 2>/dev/null; then
+    echo "Installing numpy and OpenCV for burst capture..."
+    sudo apt-get install -y python3-numpy python3-opencv
+fi
 
 echo ""
 echo "[4/6] Installing/updating camera app..."
 mkdir -p ~/.local/bin
 # Copy the app
 cp "$SCRIPT_DIR/surface-camera.py" ~/.local/bin/surface-camera
+cp "$SCRIPT_DIR/surface-burst.py" ~/.local/bin/surface-burst
+cp "$SCRIPT_DIR/surface_replay.py" ~/.local/bin/surface_replay.py
+cp "$SCRIPT_DIR/surface_threads.py" ~/.local/bin/surface_threads.py
 
 # Copy the bin directory with scripts
 mkdir -p ~/.local/bin/bin
@@ -66,7 +73,7 @@ cp "$SCRIPT_DIR/bin/camera-stream.sh" ~/.local/bin/bin/
 cp "$SCRIPT_DIR/bin/camera-cleanup.sh" ~/.local/bin/bin/
 cp "$SCRIPT_DIR/bin/camera-health-check.sh" ~/.local/bin/bin/
 
-chmod +x ~/.local/bin/surface-camera
+chmod +x ~/.local/bin/surface-camera ~/.local/bin/surface-burst
 chmod +x ~/.local/bin/bin/*.sh
 
 # Create/update desktop entry
@@ -126,6 +133,7 @@ echo ""
 echo "📱 Launch the camera app:"
 echo "   • Command: surface-camera"
 echo "   • App menu: Search for 'Surface Camera'"
+echo "   • Rear burst: surface-burst -n 10"
 echo ""
 echo "🧪 Test the cameras:"
 echo "   • Front: scripts/test-front-camera.sh"
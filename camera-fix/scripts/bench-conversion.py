@@ -0,0 +1,112 @@
+#!/usr/bin/python3
+"""
+Benchmark videoconvert thread scaling for the camera pipelines
+
+Reports the median per-frame conversion time for 1, 2, 4 and N threads at
+the preview and Howdy resolutions, for each output format the pipelines use:
+BGR (Howdy reader), YUY2 (v4l2loopback streams) and BGRx (gtksink preview).
+Conversion time is measured between pad probes on the videoconvert sink and
+source pads, so the test source does not count.
+"""
+import argparse
+import os
+import sys
+import time
+
+# CRITICAL: Set environment to use locally built libcamera 0.6.0 instead of system 0.2.0
+os.environ['GST_PLUGIN_PATH'] = '/usr/local/lib/x86_64-linux-gnu/gstreamer-1.0'
+os.environ['LD_LIBRARY_PATH'] = '/usr/local/lib/x86_64-linux-gnu:' + os.environ.get('LD_LIBRARY_PATH', '')
+
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst
+
+Gst.init(None)
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from surface_threads import available_cores
+
+WARMUP_FRAMES = 10
+
+
+def measure(width, height, threads, in_format, out_format, frames):
+    """Median milliseconds videoconvert spends on one frame"""
+    cmd = (f"videotestsrc num-buffers={frames + WARMUP_FRAMES} pattern=smpte ! "
+           f"video/x-raw,format={in_format},width={width},height={height} ! "
+           f"videoconvert name=convert n-threads={threads} ! "
+           f"video/x-raw,format={out_format} ! "
+           "fakesink sync=false")
+    pipeline = Gst.parse_launch(cmd)
+    convert = pipeline.get_by_name("convert")
+
+    # videoconvert converts in its chain function, so one buffer is in
+    # flight between the sink pad and the source pad at a time
+    start = [0.0]
+    durations = []
+
+    def on_sink(pad, info):
+        start[0] = time.perf_counter()
+        return Gst.PadProbeReturn.OK
+
+    def on_src(pad, info):
+        durations.append(time.perf_counter() - start[0])
+        return Gst.PadProbeReturn.OK
+
+    convert.get_static_pad("sink").add_probe(Gst.PadProbeType.BUFFER, on_sink)
+    convert.get_static_pad("src").add_probe(Gst.PadProbeType.BUFFER, on_src)
+
+    pipeline.set_state(Gst.State.PLAYING)
+    msg = pipeline.get_bus().timed_pop_filtered(Gst.CLOCK_TIME_NONE,
+                                                Gst.MessageType.EOS | Gst.MessageType.ERROR)
+    pipeline.set_state(Gst.State.NULL)
+
+    if msg and msg.type == Gst.MessageType.ERROR:
+        err, debug = msg.parse_error()
+        raise RuntimeError(f"GStreamer error: {err.message}")
+
+    samples = sorted(durations[WARMUP_FRAMES:])
+    if not samples:
+        raise RuntimeError("No frames converted")
+    return 1000.0 * samples[len(samples) // 2]
+
+
+def parse_size(text):
+    width, height = text.lower().split("x")
+    return int(width), int(height)
+
+
+def main():
+    cores = available_cores()
+    parser = argparse.ArgumentParser(description="Benchmark videoconvert thread scaling")
+    parser.add_argument("--sizes", nargs="+", type=parse_size, default=[(640, 480), (1280, 720)],
+                        help="Resolutions as WxH (default: 640x480 1280x720, add 4208x3120 for full sensor)")
+    parser.add_argument("--threads", nargs="+", type=int, default=sorted({1, 2, 4, cores}),
+                        help=f"Thread counts (default: 1 2 4 {cores})")
+    parser.add_argument("--input-format", default="NV12", help="Source format (default: NV12)")
+    parser.add_argument("--formats", nargs="+", default=["BGR", "YUY2", "BGRx"],
+                        help="Output formats (default: BGR YUY2 BGRx)")
+    parser.add_argument("-n", "--frames", type=int, default=200, help="Frames per run (default: 200)")
+    args = parser.parse_args()
+
+    print(f"videoconvert {args.input_format} -> ..., median ms/frame over {args.frames} frames, {cores} cores")
+    print(f"{'size':>10} {'format':>6} " + " ".join(f"{f'{t} thr':>14}" for t in args.threads))
+
+    for width, height in args.sizes:
+        for out_format in args.formats:
+            cells = []
+            baseline = None
+            for threads in args.threads:
+                try:
+                    ms = measure(width, height, threads, args.input_format, out_format, args.frames)
+                except RuntimeError as e:
+                    print(f"{width}x{height} {out_format} with {threads} threads failed: {e}", file=sys.stderr)
+                    return 1
+                baseline = baseline or ms
+                cells.append(f"{ms:6.2f} ({baseline / ms:3.1f}x)")
+            print(f"{f'{width}x{height}':>10} {out_format:>6} " + " ".join(f"{c:>14}" for c in cells))
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
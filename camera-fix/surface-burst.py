@@ -0,0 +1,230 @@
+#!/usr/bin/python3
+"""
+Surface Pro 9 Burst Capture - full-resolution stills from the rear OV13858
+Captures N frames back to back into preallocated buffers while a thread pool
+flips, encodes and writes them to ~/Pictures/SurfaceCamera.
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+# CRITICAL: Set environment to use locally built libcamera 0.6.0 instead of system 0.2.0
+os.environ['GST_PLUGIN_PATH'] = '/usr/local/lib/x86_64-linux-gnu/gstreamer-1.0'
+os.environ['LD_LIBRARY_PATH'] = '/usr/local/lib/x86_64-linux-gnu:' + os.environ.get('LD_LIBRARY_PATH', '')
+
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst, GLib
+import numpy as np
+import cv2
+
+Gst.init(None)
+
+# Installed next to this script by install.sh (added with the conversion
+# thread sizing); the burst tool only needs the affinity-aware core count
+try:
+    from surface_threads import available_cores
+except ImportError:
+    def available_cores():
+        return len(os.sched_getaffinity(0))
+
+# Rear camera (OV13858) - double backslash so Gst.parse_launch() receives a single one
+REAR_CAMERA_NAME = "\\\\_SB_.PC00.I2C2.CAMR"
+
+# OV13858 active pixel array
+FULL_WIDTH = 4208
+FULL_HEIGHT = 3120
+
+
+class BurstCapture:
+    """
+    Opens the rear camera with the still-capture stream role at full sensor
+    resolution and copies consecutive frames into a preallocated
+    (N, H, W, 3) array. Each frame is handed to an encoder pool as soon as
+    it lands, so capture only waits on the sensor.
+    """
+
+    def __init__(self, count, width, height, quality, workers, output_dir):
+        self.count = count
+        self.width = width
+        self.height = height
+        self.quality = quality
+        self.workers = workers
+        self.output_dir = output_dir
+        self.pipeline = None
+        self.appsink = None
+
+        # Row stride of a packed BGR frame (GStreamer pads rows to 4 bytes)
+        self.stride = (width * 3 + 3) & ~3
+
+        # Preallocated before the camera opens so capture never allocates
+        self.frames = np.empty((count, height, width, 3), dtype=np.uint8)
+        self.timestamps = np.zeros(count, dtype=np.int64)
+
+        # Per-frame encode time, filled in by the worker threads
+        self.encode_times = [0.0] * count
+        self.encode_bytes = [0] * count
+
+    def _create_pipeline(self):
+        """Create the full-resolution still pipeline"""
+        # Rotation is done by the encoder workers, the conversion is spread
+        # over all cores so the streaming thread keeps up with the sensor
+        cmd = (f'libcamerasrc camera-name="{REAR_CAMERA_NAME}" src::stream-role=still-capture ! '
+               f"video/x-raw,width={self.width},height={self.height} ! "
+               f"videoconvert n-threads={available_cores()} ! "
+               "video/x-raw,format=BGR ! "
+               f"appsink name=sink sync=false max-buffers={self.count} drop=false")
+        print(f"Pipeline: {cmd}")
+
+        self.pipeline = Gst.parse_launch(cmd)
+        self.appsink = self.pipeline.get_by_name("sink")
+
+        ret = self.pipeline.set_state(Gst.State.PLAYING)
+        if ret == Gst.StateChangeReturn.FAILURE:
+            bus = self.pipeline.get_bus()
+            msg = bus.pop_filtered(Gst.MessageType.ERROR)
+            if msg:
+                err, debug = msg.parse_error()
+                raise RuntimeError(f"GStreamer error: {err.message}")
+            raise RuntimeError("Failed to start GStreamer pipeline")
+
+    def _encode(self, index, prefix):
+        """Rotate, encode and write one frame (runs on the encoder pool)"""
+        start = time.perf_counter()
+
+        # OpenCV releases the GIL here, so the pool scales across cores
+        frame = cv2.rotate(self.frames[index], cv2.ROTATE_180)
+        ok, jpeg = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+        if not ok:
+            raise RuntimeError(f"Failed to encode frame {index}")
+
+        path = os.path.join(self.output_dir, f"{prefix}_{index:03d}.jpg")
+        with open(path, "wb") as f:
+            f.write(jpeg.tobytes())
+
+        self.encode_times[index] = time.perf_counter() - start
+        self.encode_bytes[index] = len(jpeg)
+        return path
+
+    def _copy_sample(self, sample, index):
+        """Copy a sample into its preallocated slot"""
+        buffer = sample.get_buffer()
+        success, map_info = buffer.map(Gst.MapFlags.READ)
+        if not success:
+            raise RuntimeError(f"Failed to map frame {index}")
+        try:
+            rows = np.ndarray(shape=(self.height, self.stride), dtype=np.uint8, buffer=map_info.data)
+            self.frames[index] = rows[:, :self.width * 3].reshape(self.height, self.width, 3)
+        finally:
+            buffer.unmap(map_info)
+        if buffer.pts != Gst.CLOCK_TIME_NONE:
+            self.timestamps[index] = buffer.pts
+
+    def run(self, warmup=0, timeout=5.0):
+        """
+        Capture the burst and wait for all frames to be written
+
+        Args:
+            warmup: Frames to discard first while auto-exposure settles
+            timeout: Maximum seconds to wait for each frame
+
+        Returns:
+            Dict of burst statistics
+        """
+        os.makedirs(self.output_dir, exist_ok=True)
+        prefix = "burst_" + datetime.now().strftime("%Y%m%d_%H%M%S")
+        timeout_ns = int(timeout * Gst.SECOND)
+
+        self._create_pipeline()
+        try:
+            for _ in range(warmup):
+                if not self.appsink.emit("try-pull-sample", timeout_ns):
+                    raise RuntimeError("Timed out waiting for warm-up frame")
+
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                futures = []
+                capture_start = time.perf_counter()
+                for index in range(self.count):
+                    sample = self.appsink.emit("try-pull-sample", timeout_ns)
+                    if not sample:
+                        raise RuntimeError(f"Timed out waiting for frame {index}")
+                    self._copy_sample(sample, index)
+                    futures.append(pool.submit(self._encode, index, prefix))
+                capture_end = time.perf_counter()
+
+                paths = [future.result() for future in futures]
+                encode_end = time.perf_counter()
+        finally:
+            self.pipeline.set_state(Gst.State.NULL)
+            self.pipeline.get_state(5 * Gst.SECOND)
+            self.pipeline = None
+            self.appsink = None
+
+        return self._stats(paths, capture_start, capture_end, encode_end)
+
+    def _stats(self, paths, capture_start, capture_end, encode_end):
+        """Summarise sensor and encoder throughput"""
+        # Sensor rate from buffer timestamps, wall clock as fallback
+        span_ns = int(self.timestamps[-1] - self.timestamps[0])
+        if self.count > 1 and span_ns > 0:
+            burst_fps = (self.count - 1) * Gst.SECOND / span_ns
+        else:
+            burst_fps = self.count / max(capture_end - capture_start, 1e-9)
+
+        total_encode = sum(self.encode_times)
+        encode_fps = self.count / max(encode_end - capture_start, 1e-9)
+        return {
+            "frames": self.count,
+            "resolution": f"{self.width}x{self.height}",
+            "workers": self.workers,
+            "burst_fps": burst_fps,
+            "capture_seconds": capture_end - capture_start,
+            "drain_seconds": encode_end - capture_end,
+            "encode_fps": encode_fps,
+            "encode_fps_per_core": self.count / max(total_encode, 1e-9),
+            "encode_ms_per_frame": 1000.0 * total_encode / self.count,
+            "encode_mb": sum(self.encode_bytes) / 1e6,
+            "files": paths,
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Full-resolution burst capture from the rear camera")
+    parser.add_argument("-n", "--count", type=int, default=10, help="Frames to capture (default: 10)")
+    parser.add_argument("--width", type=int, default=FULL_WIDTH)
+    parser.add_argument("--height", type=int, default=FULL_HEIGHT)
+    parser.add_argument("--quality", type=int, default=92, help="JPEG quality (default: 92)")
+    parser.add_argument("--workers", type=int, default=available_cores(),
+                        help="Encoder threads (default: number of cores)")
+    parser.add_argument("--warmup", type=int, default=5,
+                        help="Frames to discard while auto-exposure settles (default: 5)")
+    parser.add_argument("--output", default=os.path.expanduser("~/Pictures/SurfaceCamera"))
+    args = parser.parse_args()
+
+    if args.count < 1:
+        parser.error("--count must be at least 1")
+
+    burst = BurstCapture(args.count, args.width, args.height, args.quality,
+                         max(1, args.workers), args.output)
+    try:
+        stats = burst.run(warmup=args.warmup)
+    except (RuntimeError, OSError, GLib.Error, cv2.error) as e:
+        # Camera errors, unwritable --output, pipeline parse and encoder errors
+        print(f"Burst capture failed: {e}", file=sys.stderr)
+        return 1
+
+    print(f"Captured {stats['frames']} frames at {stats['resolution']} with {stats['workers']} encoder threads")
+    print(f"  Sustained burst:      {stats['burst_fps']:.2f} fps ({stats['capture_seconds']:.2f}s)")
+    print(f"  Encode drain after:   {stats['drain_seconds']:.2f}s")
+    print(f"  Encode throughput:    {stats['encode_fps']:.2f} fps total, "
+          f"{stats['encode_fps_per_core']:.2f} fps per core "
+          f"({stats['encode_ms_per_frame']:.1f} ms/frame)")
+    print(f"  Written:              {stats['encode_mb']:.1f} MB to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,12 +3,17 @@
 Surface Pro 9 Camera App - Combined GUI + Working Logic
 GUI from surface-camera.py with the working camera logic from camera_app_simple.py
 """
+import argparse
 import gi
 import subprocess
 import os
 import sys
+import gc
+import json
+import queue
 import threading
 import time
+from collections import deque
 from datetime import datetime
 
 # CRITICAL: Set environment to use locally built libcamera 0.6.0 instead of system 0.2.0
@@ -16,12 +21,755 @@ from datetime import datetime
 os.environ['GST_PLUGIN_PATH'] = '/usr/local/lib/x86_64-linux-gnu/gstreamer-1.0'
 os.environ['LD_LIBRARY_PATH'] = '/usr/local/lib/x86_64-linux-gnu:' + os.environ.get('LD_LIBRARY_PATH', '')
 
+parser = argparse.ArgumentParser(description="Surface Pro 9 camera app")
+parser.add_argument("--trace", action="store_true",
+                    help="Enable GStreamer latency/proctime tracers for the performance HUD")
+parser.add_argument("--replay", metavar="FILE",
+                    help="Preview a surface_replay.py recording instead of the cameras")
+parser.add_argument("--replay-fast", action="store_true",
+                    help="Replay as fast as possible instead of at the recorded timing")
+ARGS, _ = parser.parse_known_args()
+
+# Optional per-element latency tracing (--trace or SURFACE_CAMERA_TRACE=1)
+# Tracers are read from the environment by Gst.init(), so set them first
+TRACING = ARGS.trace or os.environ.get('SURFACE_CAMERA_TRACE') == '1'
+if TRACING:
+    os.environ['GST_TRACERS'] = 'latency(flags=pipeline+element);interlatency;proctime'
+    os.environ['GST_DEBUG'] = ','.join(filter(None, [os.environ.get('GST_DEBUG'), 'GST_TRACER:7']))
+
 gi.require_version('Gtk', '3.0')
 gi.require_version('Gst', '1.0')
-from gi.repository import Gtk, Gst, GLib, Gdk
+gi.require_version('GstVideo', '1.0')
+from gi.repository import Gtk, Gst, GstVideo, GLib, Gdk
 
 Gst.init(None)
 
+# Installed next to this script by install.sh
+from surface_threads import conversion_threads
+
+# Opened once here so a bad or oversized recording is reported before the
+# window opens; the controller attaches it to every pipeline it builds
+REPLAY = None
+if ARGS.replay:
+    from surface_replay import ReplaySource
+    try:
+        REPLAY = ReplaySource(ARGS.replay, realtime=not ARGS.replay_fast, loop=True)
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+
+
+class PerfMonitor:
+    """
+    Collects preview performance numbers for the HUD and for export.
+
+    Delivered fps and glass-to-glass latency (sensor timestamp to gtksink)
+    come from a buffer probe on the sink pad. With tracing enabled the
+    latency, interlatency and proctime tracers are routed into this object
+    instead of stderr, which adds per-element processing times.
+    """
+
+    WINDOW = 120  # Samples kept per metric (~4s at 30fps)
+    RECORDS = 8192  # Raw tracer records kept until the next snapshot
+
+    TRACERS = ("proctime", "element-latency", "interlatency", "latency")
+
+    def __init__(self, tracing):
+        self.tracing = tracing
+        self.lock = threading.Lock()
+        self.camera = None
+        self.frame_times = deque(maxlen=self.WINDOW)
+        self.frame_latency = deque(maxlen=self.WINDOW)
+        self.records = deque(maxlen=self.RECORDS)  # Unparsed tracer records
+        self.traces = {}  # (tracer, element or link) -> deque of ns, main thread only
+        self.cpu_sample = (time.monotonic(), sum(os.times()[:2]))
+        self.cpu_percent = 0.0
+
+        if tracing:
+            Gst.debug_add_log_function(self._on_gst_log, None)
+            # Drop the default stderr handler, tracers log several lines per frame
+            Gst.debug_remove_log_function(None)
+
+    def attach(self, pipeline, camera_type):
+        """Start collecting for a new preview pipeline"""
+        with self.lock:
+            self.camera = camera_type
+            self.frame_times.clear()
+            self.frame_latency.clear()
+            self.records.clear()
+            self.traces = {}
+
+        sink = pipeline.get_by_name("sink")
+        sink.get_static_pad("sink").add_probe(Gst.PadProbeType.BUFFER, self._on_frame, sink)
+
+    def _on_frame(self, pad, info, sink):
+        """Buffer probe on the gtksink pad (streaming thread)"""
+        now = time.monotonic()
+        buffer = info.get_buffer()
+        latency = None
+        clock = sink.get_clock()
+        if clock and buffer.pts != Gst.CLOCK_TIME_NONE:
+            latency = clock.get_time() - sink.get_base_time() - buffer.pts
+
+        with self.lock:
+            self.frame_times.append(now)
+            if latency is not None and latency >= 0:
+                self.frame_latency.append(latency)
+        return Gst.PadProbeReturn.OK
+
+    def _on_gst_log(self, category, level, file, function, line, obj, message, user_data):
+        """
+        GStreamer log function, only tracer records are kept. Runs on every
+        streaming thread for every record, so the text is stored as is and
+        parsed by snapshot() rather than here.
+        """
+        if category.get_name() != "GST_TRACER":
+            # The default handler is removed, so keep warnings and errors visible
+            if level <= Gst.DebugLevel.WARNING:
+                print(f"GStreamer {level.value_nick}: {message.get()}", file=sys.stderr)
+            return
+
+        text = message.get()
+        if text.split(",", 1)[0] in self.TRACERS:
+            with self.lock:
+                self.records.append(text)
+
+    @staticmethod
+    def _parse_ns(value):
+        """
+        Tracer time as integer nanoseconds. Core tracers log a number,
+        GstShark logs a formatted H:MM:SS.fffffffff string. None if neither.
+        """
+        if isinstance(value, int):
+            return value
+        try:
+            clock, fraction = str(value).split(".")
+            hours, minutes, seconds = (int(part) for part in clock.split(":"))
+            fraction = int(fraction.ljust(9, "0")[:9])
+        except ValueError:
+            return None
+        return ((hours * 60 + minutes) * 60 + seconds) * Gst.SECOND + fraction
+
+    def _parse_records(self, records):
+        """Move raw tracer records into the per-stage sample windows"""
+        for text in records:
+            structure = Gst.Structure.new_from_string(text)
+            if structure is None:
+                continue
+
+            tracer = structure.get_name()
+            if tracer in ("proctime", "element-latency"):
+                key = structure.get_value("element")
+            elif tracer == "interlatency":
+                key = f"{structure.get_value('from_pad')} -> {structure.get_value('to_pad')}"
+            else:
+                key = f"{structure.get_value('src-element')} -> {structure.get_value('sink-element')}"
+
+            ns = self._parse_ns(structure.get_value("time"))
+            if ns is None:
+                continue
+            samples = self.traces.get((tracer, key))
+            if samples is None:
+                samples = self.traces[(tracer, key)] = deque(maxlen=self.WINDOW)
+            samples.append(ns)
+
+    @staticmethod
+    def _summary_ms(samples):
+        """Mean and 95th percentile of nanosecond samples, in milliseconds"""
+        if not samples:
+            return None
+        ordered = sorted(samples)
+        p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+        return {"mean": sum(ordered) / len(ordered) / 1e6, "p95": p95 / 1e6, "samples": len(ordered)}
+
+    def snapshot(self):
+        """Current numbers as a plain dict (main thread)"""
+        now = time.monotonic()
+        cpu = sum(os.times()[:2])
+        last_time, last_cpu = self.cpu_sample
+        if now - last_time > 0.2:
+            self.cpu_percent = 100.0 * (cpu - last_cpu) / (now - last_time)
+            self.cpu_sample = (now, cpu)
+
+        with self.lock:
+            frame_times = list(self.frame_times)
+            frame_latency = list(self.frame_latency)
+            records = list(self.records)
+            self.records.clear()
+
+        # Only the main thread touches the parsed windows
+        self._parse_records(records)
+        traces = {key: list(samples) for key, samples in self.traces.items()}
+
+        fps = 0.0
+        if len(frame_times) > 1 and frame_times[-1] > frame_times[0]:
+            fps = (len(frame_times) - 1) / (frame_times[-1] - frame_times[0])
+
+        stages = {}
+        for (tracer, key), samples in sorted(traces.items()):
+            stages.setdefault(tracer, {})[key] = self._summary_ms(samples)
+
+        return {
+            "camera": self.camera,
+            "tracing": self.tracing,
+            "fps": fps,
+            "glass_to_glass_ms": self._summary_ms(frame_latency),
+            "cpu_percent": self.cpu_percent,
+            "cpu_count": os.cpu_count(),
+            "stages": stages,
+        }
+
+    def format_hud(self):
+        """Render the snapshot as HUD text"""
+        stats = self.snapshot()
+        lines = [f"{stats['camera'] or '-'} camera   {stats['fps']:5.1f} fps   CPU {stats['cpu_percent']:5.1f}%"]
+
+        latency = stats["glass_to_glass_ms"]
+        if latency:
+            lines.append(f"glass-to-glass  {latency['mean']:6.1f} ms  (p95 {latency['p95']:.1f})")
+
+        if not self.tracing:
+            lines.append("per-element times: start with --trace")
+        for tracer, title in (("proctime", "proctime"), ("element-latency", "element latency"),
+                              ("interlatency", "interlatency"), ("latency", "pipeline latency")):
+            entries = stats["stages"].get(tracer)
+            if not entries:
+                continue
+            lines.append(title)
+            for key, summary in entries.items():
+                lines.append(f"  {key:<28} {summary['mean']:6.2f} ms  (p95 {summary['p95']:.2f})")
+        return "\n".join(lines)
+
+    def export(self, directory="/tmp"):
+        """Write the snapshot as JSON for offline comparison, returns the path"""
+        stats = self.snapshot()
+        stats["exported"] = datetime.now().isoformat(timespec="seconds")
+        path = os.path.join(directory, f"surface_camera_perf_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+        with open(path, "w") as f:
+            json.dump(stats, f, indent=2)
+        return path
+
+
+class CameraState:
+    """States of the preview pipeline owned by CameraController"""
+    IDLE = "idle"            # No pipeline and nothing to start
+    STOPPING = "stopping"    # Old pipeline is going to NULL off the main loop
+    SETTLING = "settling"    # Waiting for the released sensor to settle
+    STARTING = "starting"    # New pipeline is going to PLAYING
+    STREAMING = "streaming"  # Preview is running
+    FAILED = "failed"        # Gave up on the target camera until the next request
+
+
+class PipelineWorker:
+    """
+    Runs blocking pipeline work (state changes, preview photo encoding)
+    off the main loop, one job at a time and in submission order. A NULL queued after a PLAYING for the same
+    pipeline therefore always runs last, which a shared thread pool such
+    as Gst.Element.call_async() does not guarantee.
+    """
+
+    def __init__(self, log):
+        self.log = log
+        self.jobs = queue.Queue()
+        self.thread = threading.Thread(target=self._run, name="pipeline-worker", daemon=True)
+        self.thread.start()
+
+    def submit(self, func, *args):
+        self.jobs.put((func, args))
+
+    def stop(self):
+        """Finish the queued jobs, then exit"""
+        self.jobs.put(None)
+
+    def _run(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                return
+            func, args = job
+            try:
+                func(*args)
+            except Exception as e:
+                self.log(f"Pipeline job {func.__name__} failed: {e}")
+
+
+class CameraController:
+    """
+    State machine that owns the preview pipeline.
+
+    Every transition runs on the GLib main loop: bus messages arrive through
+    the bus signal watch and delays are GLib timeouts. The blocking GStreamer
+    state changes run in order on a PipelineWorker and report back with
+    GLib.idle_add(), so the UI never waits on the camera.
+
+    request() only records the target camera. A start in flight for another
+    camera is cancelled, and repeated requests coalesce to the latest target.
+    """
+
+    MAX_RETRIES = 2
+    RETRY_DELAY = 2.0      # Seconds before the first retry, grows 1.5x per attempt
+    START_TIMEOUT = 20     # Seconds to reach PLAYING (cameras can be slow to wake)
+
+    # Front camera (OV5693) is slower to release - rear (OV13858) releases faster
+    SETTLE_TIME = {"front": 1.0, "rear": 0.5}
+
+    def __init__(self, app):
+        self.app = app
+        self.state = CameraState.IDLE
+        self.target = None       # Camera the user asked for last
+        self.active = None       # Camera the current pipeline was built for
+        self.pipeline = None
+        self.bus = None
+        self.bus_handler = None
+        self.attempt = 0
+        self.timeout_id = None
+        self.closed = False
+        self.worker = PipelineWorker(app.log_message)
+
+        # Still-capture stream of the current pipeline (None when single-stream).
+        # still_pending is claimed under still_lock by whichever of the sample
+        # and the timeout comes first; still_serial tells captures apart.
+        self.dual_stream = False
+        self.still_valve = None
+        self.still_probe = None
+        self.still_pending = False
+        self.still_serial = 0
+        self.still_lock = threading.Lock()
+
+        # Cameras whose pipeline handler rejected the two-stream configuration,
+        # and whether the current start failed that way
+        self.single_stream = set()
+        self.streams_rejected = False
+
+        # Bumped for every new pipeline and every teardown. Callbacks carry
+        # the generation they were scheduled for and are ignored once stale,
+        # which is what cancels an in-flight switch.
+        self.generation = 0
+
+    def request(self, camera_type):
+        """Switch to camera_type. Returns immediately."""
+        if self.closed:
+            return
+
+        if camera_type != self.target:
+            self.attempt = 0
+        self.target = camera_type
+        self.app.log_message(f"Camera requested: {camera_type} (state: {self.state}, active: {self.active})")
+
+        if self.state in (CameraState.IDLE, CameraState.FAILED):
+            self._start()
+        elif self.state in (CameraState.STARTING, CameraState.STREAMING):
+            if self.active != camera_type:
+                if self.state == CameraState.STARTING:
+                    self.app.log_message(f"Cancelling in-flight start of {self.active} camera")
+                self._stop()
+        # STOPPING / SETTLING: the latest target is started once the settle delay ends
+
+    def shutdown(self):
+        """Stop the pipeline synchronously (used on application exit)"""
+        self.closed = True
+        self.generation += 1
+        self._cancel_timeout()
+
+        pipeline = self.pipeline
+        self._detach_bus()
+        self.pipeline = None
+        self.still_valve = None
+
+        # Queued behind any pending PLAYING/NULL jobs, so no pipeline can be
+        # left running by a state change that was still in flight
+        done = threading.Event()
+        self.worker.submit(self._shutdown_pipeline, pipeline, done)
+        self.worker.stop()
+        if not done.wait(15):
+            self.app.log_message("Timed out waiting for pipeline jobs on exit")
+
+        self.state = CameraState.IDLE
+
+    def _shutdown_pipeline(self, pipeline, done):
+        """Runs on the pipeline worker"""
+        try:
+            if pipeline:
+                # Stop the pipeline and wait for it to fully stop
+                self.app.log_message("Stopping pipeline...")
+                pipeline.set_state(Gst.State.NULL)
+                ret, state, pending = pipeline.get_state(5 * Gst.SECOND)
+                if ret == Gst.StateChangeReturn.SUCCESS:
+                    self.app.log_message("Pipeline stopped successfully")
+                else:
+                    self.app.log_message(f"Pipeline stop returned: {ret}")
+        except Exception as e:
+            self.app.log_message(f"Error stopping pipeline on exit: {e}")
+        finally:
+            done.set()
+
+    def _is_stale(self, generation):
+        return self.closed or generation != self.generation
+
+    def _cancel_timeout(self):
+        if self.timeout_id is not None:
+            GLib.source_remove(self.timeout_id)
+            self.timeout_id = None
+
+    def _detach_bus(self):
+        """Disconnect from the current bus so no further messages are handled"""
+        if self.bus:
+            try:
+                if self.bus_handler is not None:
+                    self.bus.disconnect(self.bus_handler)
+                self.bus.remove_signal_watch()
+                self.app.log_message("Bus signal watch removed")
+            except Exception as e:
+                self.app.log_message(f"Error removing bus watch: {e}")
+        self.bus = None
+        self.bus_handler = None
+
+    # --- Starting ---------------------------------------------------------
+
+    def _start(self):
+        """Build the pipeline for the target camera and start it asynchronously"""
+        camera_type = self.target
+        self.generation += 1
+        generation = self.generation
+        self.state = CameraState.STARTING
+        self.active = camera_type
+
+        if self.attempt > 0:
+            self.app.update_status(f"⚠️ Retrying camera start... (attempt {self.attempt}/{self.MAX_RETRIES})", show_spinner=True)
+        else:
+            self.app.update_status(f"🎥 Starting {camera_type} camera preview...", show_spinner=True)
+
+        camera = self.app.cameras[camera_type]
+        camera_name = camera['name']
+        self.app.log_message(f"Using camera: {camera_name} ({camera['label']})")
+
+        # Preview pipeline:
+        # libcamerasrc -> queue -> caps -> videoflip -> videoconvert -> gtksink
+        # IMPORTANT: camera-name must be quoted because it contains backslashes
+        # Elements are named so tracer output is readable in the HUD
+        threads = conversion_threads()
+        replay = self.app.replay
+        self.dual_stream = False
+        self.streams_rejected = False
+        if replay:
+            # Recorded raw frames stand in for either camera, with their own caps
+            source = f"{replay.description('src')} ! queue name=queue max-size-buffers=3 ! "
+            self.app.log_message(f"Replaying {self.app.replay_path} in place of the {camera_type} camera")
+        elif camera_type in self.single_stream:
+            source = (f'libcamerasrc name=src camera-name="{camera_name}" ! '
+                      "queue name=queue max-size-buffers=3 leaky=downstream ! "
+                      "video/x-raw,width=1280,height=720 ! ")
+        else:
+            # One libcamera session with two streams: the 1280x720 viewfinder
+            # feeds the preview, and a still-capture stream at the sensor's
+            # full resolution is dropped at the valve until a photo is taken
+            self.dual_stream = True
+            source = (f'libcamerasrc name=src camera-name="{camera_name}" '
+                      "src::stream-role=view-finder src_0::stream-role=still-capture "
+                      "src.src_0 ! valve name=still_valve drop=true ! "
+                      "queue name=still_queue max-size-buffers=1 ! "
+                      "videoflip name=still_flip method=rotate-180 ! "
+                      f"videoconvert name=still_convert n-threads={threads} ! "
+                      "jpegenc name=still_enc quality=92 ! "
+                      "appsink name=still_sink emit-signals=true sync=false async=false "
+                      "max-buffers=1 drop=false "
+                      "src.src ! "
+                      "queue name=queue max-size-buffers=3 leaky=downstream ! "
+                      "video/x-raw,width=1280,height=720 ! ")
+        cmd = (source +
+               "videoflip name=flip method=rotate-180 ! "
+               f"videoconvert name=convert n-threads={threads} ! "
+               "gtksink name=sink sync=false")
+        self.app.log_message(f"GStreamer pipeline command: {cmd}")
+
+        try:
+            self.pipeline = Gst.parse_launch(cmd)
+        except Exception as e:
+            self._on_start_failed(f"Could not create pipeline: {e}")
+            return
+        if replay:
+            replay.attach(self.pipeline.get_by_name("src"))
+        if self.dual_stream:
+            self.still_valve = self.pipeline.get_by_name("still_valve")
+            self.pipeline.get_by_name("still_sink").connect("new-sample", self._on_still_sample)
+
+        # Set up bus to monitor for errors - BEFORE doing anything else
+        self.bus = self.pipeline.get_bus()
+        self.bus.add_signal_watch()
+        self.bus_handler = self.bus.connect("message", self._on_bus_message, generation)
+
+        # Get sink and connect to widget
+        widget = self.pipeline.get_by_name("sink").get_property("widget")
+        self.app.set_video_widget(widget)
+        self.app.perf.attach(self.pipeline, camera_type)
+
+        self.timeout_id = GLib.timeout_add_seconds(self.START_TIMEOUT, self._on_start_timeout, generation)
+
+        # NULL -> READY opens the camera and can block, so run it off the main loop
+        self.app.log_message("Setting pipeline to PLAYING state...")
+        self.worker.submit(self._set_playing, self.pipeline, generation)
+
+    def _set_playing(self, pipeline, generation):
+        """Runs on the pipeline worker"""
+        ret = pipeline.set_state(Gst.State.PLAYING)
+        GLib.idle_add(self._on_set_playing_returned, generation, ret)
+
+    def _on_set_playing_returned(self, generation, ret):
+        if self._is_stale(generation):
+            return False
+
+        self.app.log_message(f"set_state returned: {ret}")
+        if ret == Gst.StateChangeReturn.FAILURE:
+            self._on_start_failed("Unable to set pipeline to playing")
+        elif ret == Gst.StateChangeReturn.SUCCESS and self.state == CameraState.STARTING:
+            self._on_streaming()
+        # ASYNC / NO_PREROLL: wait for the STATE_CHANGED message on the bus
+        return False
+
+    def _on_start_timeout(self, generation):
+        self.timeout_id = None
+        if self._is_stale(generation) or self.state != CameraState.STARTING:
+            return False
+
+        ret, current, pending = self.pipeline.get_state(0)
+        # PAUSED state is actually okay - it means pipeline is ready and prerolled
+        # The camera will transition to PLAYING once frames start flowing
+        if current == Gst.State.PAUSED and pending == Gst.State.VOID_PENDING:
+            self.app.log_message("Pipeline in PAUSED state (prerolled), will transition to PLAYING automatically")
+            self._on_streaming()
+        else:
+            self._on_start_failed(f"Pipeline stuck in {current} state (pending: {pending}), expected PLAYING")
+        return False
+
+    def _on_start_failed(self, reason):
+        self.app.log_message(f"Camera start failed (attempt {self.attempt}): {reason}")
+        if self.dual_stream and self.streams_rejected:
+            # Not every libcamera pipeline handler can run two streams at once
+            self.app.log_message(f"Falling back to a single viewfinder stream for the {self.active} camera")
+            self.single_stream.add(self.active)
+        self.attempt += 1
+
+        if self.attempt > self.MAX_RETRIES:
+            self.app.update_status(f"❌ Camera failed to start after {self.MAX_RETRIES} retries. "
+                                   "Switch cameras or restart the app.", show_spinner=False)
+            self._stop(failed=True)
+        else:
+            delay = self.RETRY_DELAY * 1.5 ** (self.attempt - 1)  # Exponential backoff
+            self.app.log_message(f"Retry attempt {self.attempt}/{self.MAX_RETRIES} after {delay}s delay...")
+            self._stop(retry_delay=delay)
+
+    def _on_streaming(self):
+        self._cancel_timeout()
+        self.state = CameraState.STREAMING
+        self.attempt = 0
+        self.app.log_message(f"Pipeline reached PLAYING, {self.active} camera streaming")
+        self.app.on_camera_streaming(self.active)
+
+    # --- Photos -----------------------------------------------------------
+
+    def capture_still(self):
+        """
+        Save one photo without reconfiguring the camera. Uses the next frame
+        of the full-resolution still stream, or the last preview frame when
+        the camera runs a single stream. Returns False if nothing is streaming.
+        """
+        if self.state != CameraState.STREAMING:
+            return False
+
+        if self.still_valve is None:
+            self.worker.submit(self._save_preview_frame, self.pipeline)
+            return True
+
+        with self.still_lock:
+            if self.still_pending:
+                return True
+            self.still_pending = True
+            self.still_serial += 1
+
+        # Let exactly one buffer through: the probe closes the valve again
+        # from inside the valve's chain, before the next buffer arrives
+        pad = self.still_valve.get_static_pad("src")
+        self.still_probe = pad.add_probe(Gst.PadProbeType.BUFFER, self._on_still_passed)
+        self.still_valve.set_property("drop", False)
+        GLib.timeout_add_seconds(5, self._on_still_timeout, self.generation, self.still_serial)
+        return True
+
+    def _on_still_timeout(self, generation, serial):
+        if self._is_stale(generation):
+            return False
+        with self.still_lock:
+            if not self.still_pending or serial != self.still_serial:
+                return False  # Saved in time, or a later capture
+            self.still_pending = False
+
+        # Close the valve and drop the probe if no buffer came through; a frame
+        # already past the valve is discarded by _on_still_sample
+        self.still_valve.set_property("drop", True)
+        probe, self.still_probe = self.still_probe, None
+        if probe is not None:
+            self.still_valve.get_static_pad("src").remove_probe(probe)
+        self.app.on_photo_saved(None, "Still stream delivered no frame")
+        return False
+
+    def _on_still_passed(self, pad, info):
+        """Pad probe on the still valve (streaming thread)"""
+        self.still_probe = None
+        pad.get_parent_element().set_property("drop", True)
+        return Gst.PadProbeReturn.REMOVE
+
+    def _on_still_sample(self, appsink):
+        """JPEG from the still stream (streaming thread)"""
+        sample = appsink.emit("pull-sample")
+        with self.still_lock:
+            wanted = self.still_pending
+            self.still_pending = False
+        if not wanted:
+            # The user was already told this capture failed
+            GLib.idle_add(self.app.log_message, "Discarded a still frame that arrived after the timeout")
+        elif sample:
+            self._write_photo(sample.get_buffer())
+        return Gst.FlowReturn.OK
+
+    def _save_preview_frame(self, pipeline):
+        """Encode the last preview frame (runs on the pipeline worker)"""
+        sample = pipeline.get_by_name("sink").get_property("last-sample")
+        if sample is None:
+            GLib.idle_add(self.app.on_photo_saved, None, "No preview frame yet")
+            return
+        try:
+            jpeg = GstVideo.video_convert_sample(sample, Gst.Caps.from_string("image/jpeg"), 5 * Gst.SECOND)
+        except Exception as e:
+            GLib.idle_add(self.app.on_photo_saved, None, str(e))
+            return
+        self._write_photo(jpeg.get_buffer())
+
+    def _write_photo(self, buffer):
+        """Write an encoded photo and report back on the main loop"""
+        path = os.path.join(self.app.photos_dir, f"photo_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')[:-3]}.jpg")
+        try:
+            success, map_info = buffer.map(Gst.MapFlags.READ)
+            if not success:
+                raise RuntimeError("could not map photo buffer")
+            try:
+                with open(path, "wb") as f:
+                    f.write(map_info.data)
+            finally:
+                buffer.unmap(map_info)
+        except Exception as e:
+            GLib.idle_add(self.app.on_photo_saved, None, str(e))
+            return
+        GLib.idle_add(self.app.on_photo_saved, path, None)
+
+    # --- Stopping ---------------------------------------------------------
+
+    def _stop(self, retry_delay=0.0, failed=False):
+        """
+        Tear down the current pipeline off the main loop, then settle and start
+        the latest target (or enter FAILED)
+        """
+        self._cancel_timeout()
+        self.generation += 1
+        generation = self.generation
+        previous = self.active
+        pipeline = self.pipeline
+
+        # CRITICAL: Clean up bus before deleting pipeline
+        self._detach_bus()
+        self.pipeline = None
+        self.still_valve = None
+        self.still_probe = None
+        with self.still_lock:
+            self.still_pending = False
+        self.state = CameraState.STOPPING
+        self.app.log_message(f"Stopping {previous} pipeline")
+
+        if pipeline is None:
+            self._on_stopped(generation, previous, retry_delay, failed)
+        else:
+            self.worker.submit(self._set_null, pipeline, (generation, previous, retry_delay, failed))
+
+    def _set_null(self, pipeline, args):
+        """Runs on the pipeline worker, after any PLAYING queued for it"""
+        # Go directly to NULL for faster, cleaner shutdown
+        pipeline.set_state(Gst.State.NULL)
+        ret = pipeline.get_state(10 * Gst.SECOND)[0]
+        GLib.idle_add(self._on_stopped, *args, ret)
+
+    def _on_stopped(self, generation, previous, retry_delay, failed, ret=None):
+        if self._is_stale(generation):
+            return False
+
+        if ret == Gst.StateChangeReturn.FAILURE:
+            self.app.log_message("Pipeline failed to stop cleanly, forcing cleanup")
+
+        # Force garbage collection so libcamera releases the media device
+        gc.collect()
+        self.app.log_message("Pipeline deleted and garbage collected")
+        self.active = None
+
+        if failed and self.target == previous:
+            self.state = CameraState.FAILED
+            return False
+
+        # Give the camera hardware time to fully release
+        delay = self.SETTLE_TIME.get(previous, 0.0) + retry_delay
+        self.app.log_message(f"Waiting {delay:.1f}s for {previous} camera to release...")
+        self.state = CameraState.SETTLING
+        self.timeout_id = GLib.timeout_add(int(delay * 1000), self._on_settled, generation)
+        return False
+
+    def _on_settled(self, generation):
+        self.timeout_id = None
+        if self._is_stale(generation):
+            return False
+        self.state = CameraState.IDLE
+        self._start()
+        return False
+
+    # --- Bus --------------------------------------------------------------
+
+    def _rejects_streams(self, src, err, debug):
+        """
+        True if libcamerasrc refused the view-finder + still-capture pair:
+        it reports an unsupported or failed configuration as a settings
+        error, and caps it cannot satisfy as not-negotiated
+        """
+        if self.pipeline is None or src != self.pipeline.get_by_name("src"):
+            return False
+        return (err.matches(Gst.resource_error_quark(), Gst.ResourceError.SETTINGS)
+                or "not-negotiated" in (debug or ""))
+
+    def _on_bus_message(self, bus, message, generation):
+        """Handle GStreamer bus messages for the current pipeline"""
+        if self._is_stale(generation):
+            return
+
+        t = message.type
+        if t == Gst.MessageType.ERROR:
+            err, debug = message.parse_error()
+            self.app.log_message(f"GStreamer Error: {err}, {debug}")
+            if self.dual_stream and self._rejects_streams(message.src, err, debug):
+                self.streams_rejected = True
+            if self.state == CameraState.STARTING:
+                self._on_start_failed(f"{err}: {debug}")
+            else:
+                self.app.update_status("Camera Error - Hardware may need reset. "
+                                       "Switch cameras or restart the app.", show_spinner=False)
+                self._stop(failed=True)
+
+        elif t == Gst.MessageType.WARNING:
+            err, debug = message.parse_warning()
+            self.app.log_message(f"GStreamer Warning: {err}, {debug}")
+
+        elif t == Gst.MessageType.EOS:
+            self.app.log_message("End of stream")
+
+        elif t == Gst.MessageType.STATE_CHANGED and message.src == self.pipeline:
+            old, new, pending = message.parse_state_changed()
+            self.app.log_message(f"Pipeline state: {old} -> {new} (pending: {pending})")
+            if new == Gst.State.PLAYING and self.state == CameraState.STARTING:
+                self._on_streaming()
+
+
 class SurfaceCameraApp(Gtk.Window):
     def __init__(self):
         super().__init__(title="Surface Pro 9 Camera")
@@ -32,14 +780,6 @@ class SurfaceCameraApp(Gtk.Window):
         settings = Gtk.Settings.get_default()
         settings.set_property("gtk-application-prefer-dark-theme", True)
 
-        # Camera switching state management
-        self.switching_lock = threading.Lock()
-        self.is_switching = False
-        self.last_switch_time = 0
-        self.min_switch_interval = 2.0  # Minimum seconds between switches (optimized for fast switching)
-        self.countdown_timer = None  # For button countdown display
-        self.original_button_label = None  # Store original label
-
         # Camera configuration (from camera_app_simple.py)
         # IMPORTANT: Use double backslash so Gst.parse_launch() receives single backslash
         self.cameras = {
@@ -84,6 +824,15 @@ class SurfaceCameraApp(Gtk.Window):
         self.btn_folder.connect("clicked", self.on_open_folder)
         self.header.pack_end(self.btn_folder)
 
+        # Performance HUD toggle and export
+        self.btn_hud = Gtk.ToggleButton(label="HUD")
+        self.btn_hud.connect("toggled", self.on_toggle_hud)
+        self.header.pack_end(self.btn_hud)
+
+        self.btn_export = Gtk.Button(label="Export Stats")
+        self.btn_export.connect("clicked", self.on_export_stats)
+        self.header.pack_end(self.btn_export)
+
         self.current_camera = "front"
 
         # Status / Overlay
@@ -109,10 +858,30 @@ class SurfaceCameraApp(Gtk.Window):
 
         self.overlay.add_overlay(self.status_box)
 
-        # GStreamer Pipeline
-        self.pipeline = None
-        self.bus = None
-        self.is_streaming = False
+        # Performance HUD overlay (top-left, hidden until toggled)
+        css = Gtk.CssProvider()
+        css.load_from_data(b".perf-hud { background-color: rgba(0, 0, 0, 0.6); color: #ffffff; "
+                           b"font-family: monospace; padding: 6px; }")
+        Gtk.StyleContext.add_provider_for_screen(Gdk.Screen.get_default(), css,
+                                                 Gtk.STYLE_PROVIDER_PRIORITY_APPLICATION)
+        self.hud_label = Gtk.Label()
+        self.hud_label.get_style_context().add_class("perf-hud")
+        self.hud_label.set_halign(Gtk.Align.START)
+        self.hud_label.set_valign(Gtk.Align.START)
+        self.hud_label.set_margin_start(8)
+        self.hud_label.set_margin_top(8)
+        self.hud_label.set_no_show_all(True)
+        self.overlay.add_overlay(self.hud_label)
+        self.hud_timer = None
+
+        self.perf = PerfMonitor(TRACING)
+
+        # Raw recording to preview instead of the cameras (benchmarking)
+        self.replay_path = ARGS.replay
+        self.replay = REPLAY
+
+        # GStreamer Pipeline (owned by the controller state machine)
+        self.controller = CameraController(self)
 
         # Debugging log file
         self.log_file = "/tmp/surface_camera_debug.log"
@@ -139,8 +908,8 @@ class SurfaceCameraApp(Gtk.Window):
 
         # Start camera immediately (no prep scripts needed)
         # Use minimal delay - just enough to let GTK initialize
-        # Run in background thread to avoid blocking GTK main loop
-        GLib.timeout_add(100, lambda: threading.Thread(target=self.start_preview, args=("front",), daemon=True).start())
+        # The controller never blocks the GTK main loop
+        GLib.timeout_add(100, lambda: self.controller.request("front") or False)
 
     def check_camera_health(self):
         """Check camera hardware health at startup"""
@@ -215,366 +984,76 @@ class SurfaceCameraApp(Gtk.Window):
                 self.status_box.hide()
         GLib.idle_add(_update)
 
-    def start_preview(self, camera_type):
-        self.log_message(f"Entering start_preview for camera: {camera_type}")
-
-        # Acquire lock to prevent concurrent camera operations
-        if not self.switching_lock.acquire(blocking=False):
-            self.log_message("Camera switch already in progress, ignoring request")
-            self.update_status("Please wait, camera is switching...", show_spinner=False)
-            GLib.timeout_add(2000, self.update_status, "", False)
-            return False
-
-        try:
-            self.is_switching = True
-            previous_camera = self.current_camera if self.pipeline else None
-
-            # Stop existing pipeline if any
-            if self.pipeline:
-                self.log_message("Stopping existing pipeline.")
-                self.is_streaming = False
-                try:
-                    # Stop pipeline - go directly to NULL for faster, cleaner shutdown
-                    self.pipeline.set_state(Gst.State.NULL)
-                    # Wait for pipeline to fully stop with timeout
-                    state_return = self.pipeline.get_state(10 * Gst.SECOND)
-                    if state_return[0] == Gst.StateChangeReturn.FAILURE:
-                        self.log_message("Pipeline failed to stop cleanly, forcing cleanup")
-                    else:
-                        self.log_message(f"Pipeline stopped successfully (state: {state_return[1]})")
-                except Exception as e:
-                    self.log_message(f"Error stopping pipeline: {e}")
-
-                # CRITICAL: Clean up bus before deleting pipeline
-                # Remove signal watch to prevent memory leaks
-                if self.bus:
-                    try:
-                        self.bus.remove_signal_watch()
-                        self.log_message("Bus signal watch removed")
-                    except:
-                        pass
-                    self.bus = None
-
-                # CRITICAL: Unref and delete pipeline to fully release camera
-                # This ensures libcamera releases the media device
-                self.pipeline = None
-
-                # Force garbage collection to ensure GStreamer elements are cleaned up
-                import gc
-                gc.collect()
-                self.log_message("Pipeline deleted and garbage collected")
-
-                # Give the camera hardware time to fully release
-                # Different cameras need different settle times
-                if previous_camera:
-                    # Front camera (OV5693) is slower to release - needs more time
-                    # Rear camera (OV13858) releases faster
-                    if previous_camera == "front":
-                        settle_time = 1.0  # Front camera needs more settle time
-                    else:
-                        settle_time = 0.5  # Rear camera releases faster
-
-                    self.log_message(f"Waiting {settle_time}s for {previous_camera} camera to release...")
-                    time.sleep(settle_time)
-
-            self.update_status(f"🎥 Starting {camera_type} camera preview...", show_spinner=True)
-
-            camera = self.cameras[camera_type]
-            camera_name = camera['name']
-            self.log_message(f"Using camera: {camera_name} ({camera['label']})")
-
-            # IMPORTANT: Camera only wakes from suspended state when GStreamer accesses it
-            # Don't check readiness before starting - it will always be suspended
-            # The kernel's runtime PM will wake it automatically when accessed
-            # Media links are IMMUTABLE and managed by libcamera - don't try to change them manually
-
-            # Poke the camera's power state to help it wake up faster
-            try:
-                i2c_path = f"/sys/bus/i2c/devices/{camera['i2c_id']}/power/control"
-                if os.path.exists(i2c_path):
-                    with open(i2c_path, 'r') as f:
-                        current = f.read().strip()
-                    self.log_message(f"Camera power control: {current}")
-                    # Don't change it, just reading helps wake it up
-            except Exception as e:
-                self.log_message(f"Could not check camera power state: {e}")
-
-            # Try to start the pipeline with retries
-            max_retries = 2
-            retry_delay = 2.0
-
-            for attempt in range(max_retries + 1):
-                try:
-                    if attempt > 0:
-                        self.log_message(f"Retry attempt {attempt}/{max_retries} after {retry_delay}s delay...")
-                        self.update_status(f"⚠️ Retrying camera start... (attempt {attempt}/{max_retries})", show_spinner=True)
-                        time.sleep(retry_delay)
-                        retry_delay *= 1.5  # Exponential backoff
-
-                    # Create simple pipeline - just preview, no photo capture
-                    # libcamerasrc -> queue -> caps -> videoflip -> videoconvert -> gtksink
-                    # IMPORTANT: camera-name must be quoted because it contains backslashes
-                    cmd = (f'libcamerasrc camera-name="{camera_name}" ! '
-                           "queue max-size-buffers=3 leaky=downstream ! "
-                           "video/x-raw,width=1280,height=720 ! "
-                           "videoflip method=rotate-180 ! "
-                           "videoconvert ! "
-                           "gtksink name=sink sync=false")
-                    self.log_message(f"GStreamer pipeline command: {cmd}")
-
-                    self.pipeline = Gst.parse_launch(cmd)
-                    self.log_message("GStreamer pipeline launched.")
-
-                    # Set up bus to monitor for errors - BEFORE doing anything else
-                    self.bus = self.pipeline.get_bus()
-                    self.bus.add_signal_watch()
-                    error_msg = None
-
-                    def bus_error_callback(bus, message):
-                        nonlocal error_msg
-                        if message.type == Gst.MessageType.ERROR:
-                            err, debug = message.parse_error()
-                            error_msg = f"{err}: {debug}"
-                            self.log_message(f"BUS ERROR: {error_msg}")
-
-                    self.bus.connect("message::error", bus_error_callback)
-
-                    # Get sink and connect to widget
-                    sink = self.pipeline.get_by_name("sink")
-                    widget = sink.get_property("widget")
-
-                    # Replace existing video widget content
-                    for child in self.video_widget.get_children():
-                        self.video_widget.remove(child)
-                    self.video_widget.add(widget)
-                    self.video_widget.show_all()
-                    self.log_message("Video widget updated and shown.")
-
-                    # Start playing
-                    self.log_message("Setting pipeline to PLAYING state...")
-                    ret = self.pipeline.set_state(Gst.State.PLAYING)
-                    self.log_message(f"set_state returned: {ret}")
-
-                    if ret == Gst.StateChangeReturn.FAILURE:
-                        # Process any pending bus messages to get error details
-                        time.sleep(0.1)
-                        while self.bus.have_pending():
-                            msg = self.bus.pop()
-                            if msg and msg.type == Gst.MessageType.ERROR:
-                                err, debug = msg.parse_error()
-                                error_msg = f"{err}: {debug}"
-                                self.log_message(f"Error from bus: {error_msg}")
-
-                        if error_msg:
-                            raise Exception(f"Pipeline error: {error_msg}")
-                        else:
-                            raise Exception("Unable to set pipeline to playing (no error details)")
-
-                    # Wait for pipeline to reach PLAYING state with active bus message processing
-                    # This is CRITICAL for async state transitions - we must pump messages
-                    self.log_message("Waiting for pipeline to reach PLAYING state...")
-
-                    timeout_ns = 20 * Gst.SECOND  # 20 second timeout (cameras can be slow to wake)
-                    start_time = time.time()
-                    state_reached = False
-                    last_log_time = start_time
-
-                    while (time.time() - start_time) * Gst.SECOND < timeout_ns:
-                        # Actively pump bus messages - this is essential for state transitions
-                        msg = self.bus.timed_pop_filtered(
-                            100 * Gst.MSECOND,  # Poll every 100ms
-                            Gst.MessageType.ERROR | Gst.MessageType.ASYNC_DONE | Gst.MessageType.STATE_CHANGED
-                        )
-
-                        if msg:
-                            if msg.type == Gst.MessageType.ERROR:
-                                err, debug = msg.parse_error()
-                                error_msg = f"{err}: {debug}"
-                                self.log_message(f"ERROR during state change: {error_msg}")
-                                break
-                            elif msg.type == Gst.MessageType.ASYNC_DONE:
-                                self.log_message("Received ASYNC_DONE message")
-                            elif msg.type == Gst.MessageType.STATE_CHANGED:
-                                if msg.src == self.pipeline:
-                                    old, new, pending = msg.parse_state_changed()
-                                    self.log_message(f"Pipeline state: {old} -> {new} (pending: {pending})")
-
-                        # Check current state
-                        ret, current, pending = self.pipeline.get_state(0)  # Non-blocking check
-
-                        if current == Gst.State.PLAYING and pending == Gst.State.VOID_PENDING:
-                            self.log_message(f"Pipeline reached PLAYING state after {time.time() - start_time:.2f}s")
-                            state_reached = True
-                            break
-                        elif ret == Gst.StateChangeReturn.FAILURE:
-                            raise Exception("Pipeline state change failed")
-
-                        # Log progress every 2 seconds if stuck
-                        if time.time() - last_log_time > 2.0:
-                            elapsed = time.time() - start_time
-                            self.log_message(f"Still waiting for PLAYING state... (current: {current}, pending: {pending}, elapsed: {elapsed:.1f}s)")
-                            last_log_time = time.time()
-
-                    # Connect to ongoing bus message handler (signal watch already added above)
-                    self.bus.connect("message", self.on_bus_message)
-
-                    # Check final status
-                    if error_msg:
-                        raise Exception(f"GStreamer error: {error_msg}")
-
-                    if not state_reached:
-                        # Do one final blocking check with longer timeout
-                        ret, current, pending = self.pipeline.get_state(5 * Gst.SECOND)
-                        if current != Gst.State.PLAYING:
-                            # PAUSED state is actually okay - it means pipeline is ready and prerolled
-                            # The camera will transition to PLAYING once frames start flowing
-                            # This is normal behavior for live sources that are slow to start
-                            if current == Gst.State.PAUSED and pending == Gst.State.VOID_PENDING:
-                                self.log_message(f"Pipeline in PAUSED state (prerolled), will transition to PLAYING automatically")
-                                state_reached = True
-                            else:
-                                # Only fail if we're not in a reasonable state
-                                self.log_message(f"Pipeline in unexpected state, attempting recovery...")
-                                if current == Gst.State.PAUSED:
-                                    self.pipeline.set_state(Gst.State.NULL)
-                                    time.sleep(0.5)
-                                raise Exception(f"Pipeline stuck in {current} state (pending: {pending}), expected PLAYING")
-                        else:
-                            self.log_message(f"Pipeline reached PLAYING after final check")
-
-                    self.log_message("GStreamer pipeline set to PLAYING.")
-
-                    self.update_status("", show_spinner=False)
-                    self.is_streaming = True
-                    self.log_message("Streaming started, overlay hidden.")
-
-                    # Update Button Text
-                    if camera_type == "front":
-                        self.btn_switch.set_label("Switch to Rear")
-                        self.current_camera = "front"
-                    else:
-                        self.btn_switch.set_label("Switch to Front")
-                        self.current_camera = "rear"
-                    self.log_message(f"Switch button label updated to: {self.btn_switch.get_label()}")
-
-                    break  # Success! Exit retry loop
-
-                except Exception as e:
-                    self.log_message(f"Exception during start_preview (attempt {attempt}): {e}")
-
-                    # Clean up failed pipeline
-                    if self.pipeline:
-                        try:
-                            self.pipeline.set_state(Gst.State.NULL)
-                            self.pipeline.get_state(5 * Gst.SECOND)  # Wait for cleanup
-                        except:
-                            pass
-                    if self.bus:
-                        try:
-                            self.bus.remove_signal_watch()
-                        except:
-                            pass
-                        self.bus = None
-                    self.pipeline = None
-
-                    # If this was the last attempt, show error
-                    if attempt >= max_retries:
-                        self.update_status(f"❌ Camera failed to start after {max_retries} retries. Try restarting the app.", show_spinner=False)
-                        GLib.idle_add(lambda: self.btn_switch.set_sensitive(False))
-
-        finally:
-            # Always release the lock and update state
-            self.is_switching = False
-            self.last_switch_time = time.time()
-            self.switching_lock.release()
-            # Start countdown timer on button
-            GLib.idle_add(self.start_countdown_timer)
-            self.log_message("Camera switch completed, lock released, countdown started")
-
-        return False  # Don't repeat timeout
-
-    def on_bus_message(self, bus, message):
-        """Handle GStreamer bus messages"""
-        t = message.type
-        if t == Gst.MessageType.ERROR:
-            err, debug = message.parse_error()
-            self.log_message(f"GStreamer Error: {err}, {debug}")
-
-            # Stop the broken pipeline
-            if self.pipeline:
-                try:
-                    self.pipeline.set_state(Gst.State.NULL)
-                except:
-                    pass
-                self.pipeline = None
-
-            self.is_streaming = False
-            self.update_status(f"Camera Error - Hardware may need reset. Please restart the app.", show_spinner=False)
-
-            # Disable switch button to prevent further issues
-            GLib.idle_add(lambda: self.btn_switch.set_sensitive(False))
-
-        elif t == Gst.MessageType.WARNING:
-            err, debug = message.parse_warning()
-            self.log_message(f"GStreamer Warning: {err}, {debug}")
-        elif t == Gst.MessageType.EOS:
-            self.log_message("End of stream")
-            self.is_streaming = False
-        return True
-
-    def update_countdown_timer(self):
-        """Update button with countdown timer"""
-        time_since_last_switch = time.time() - self.last_switch_time
-        if time_since_last_switch < self.min_switch_interval:
-            remaining = int(self.min_switch_interval - time_since_last_switch) + 1
-            self.btn_switch.set_label(f"⏳ Wait {remaining}s")
-            self.btn_switch.set_sensitive(False)
-            return True  # Continue timer
-        else:
-            # Re-enable button with proper label
-            if self.current_camera == "front":
-                self.btn_switch.set_label("Switch to Rear")
-            else:
-                self.btn_switch.set_label("Switch to Front")
-            self.btn_switch.set_sensitive(True)
-            self.countdown_timer = None
-            return False  # Stop timer
+    def set_video_widget(self, widget):
+        """Replace existing video widget content"""
+        for child in self.video_widget.get_children():
+            self.video_widget.remove(child)
+        self.video_widget.add(widget)
+        self.video_widget.show_all()
+        self.log_message("Video widget updated and shown.")
 
-    def start_countdown_timer(self):
-        """Start the countdown timer on the button"""
-        if self.countdown_timer is None:
-            self.countdown_timer = GLib.timeout_add(100, self.update_countdown_timer)
+    def on_camera_streaming(self, camera_type):
+        """Called by the controller once the preview is running"""
+        self.current_camera = camera_type
+        self.update_status("", show_spinner=False)
+        self.log_message("Streaming started, overlay hidden.")
 
     def on_switch_camera(self, widget):
-        # Check if we're already switching
-        if self.is_switching:
-            self.log_message("Camera switch ignored - already in progress")
-            return
-
-        # Check minimum time between switches (debouncing)
-        time_since_last_switch = time.time() - self.last_switch_time
-        if time_since_last_switch < self.min_switch_interval:
-            remaining = self.min_switch_interval - time_since_last_switch
-            self.log_message(f"Camera switch too fast - {remaining:.1f}s remaining")
-            # Start countdown on button if not already running
-            self.start_countdown_timer()
-            return
-
-        # Disable switch button during transition
-        self.btn_switch.set_sensitive(False)
-        self.btn_switch.set_label("🔄 Switching...")
+        # Toggle relative to the latest request, not the camera currently
+        # streaming, so repeated clicks coalesce to what the user asked for
+        target = self.controller.target or self.current_camera
+        new_cam = "rear" if target == "front" else "front"
+        self.log_message(f"Initiating camera switch from {target} to {new_cam}")
+
+        self.btn_switch.set_label("Switch to Front" if new_cam == "rear" else "Switch to Rear")
+        self.controller.request(new_cam)
+
+    def on_toggle_hud(self, widget):
+        """Show or hide the performance HUD"""
+        if widget.get_active():
+            self.refresh_hud()
+            self.hud_label.show()
+            if self.hud_timer is None:
+                self.hud_timer = GLib.timeout_add(500, self.refresh_hud)
+        else:
+            self.hud_label.hide()
+            if self.hud_timer is not None:
+                GLib.source_remove(self.hud_timer)
+                self.hud_timer = None
 
-        new_cam = "rear" if self.current_camera == "front" else "front"
-        self.log_message(f"Initiating camera switch from {self.current_camera} to {new_cam}")
+    def refresh_hud(self):
+        self.hud_label.set_text(self.perf.format_hud())
+        return True  # Keep refreshing while visible
 
-        # Run camera switch in background thread to keep UI responsive
-        threading.Thread(target=self.start_preview, args=(new_cam,), daemon=True).start()
+    def on_export_stats(self, widget):
+        """Write the current performance numbers to a JSON file"""
+        try:
+            path = self.perf.export()
+            self.log_message(f"Performance stats exported to {path}")
+            self.update_status(f"Stats exported to {path}", show_spinner=False)
+        except Exception as e:
+            self.log_message(f"Could not export stats: {e}")
+            self.update_status(f"Could not export stats: {e}", show_spinner=False)
+        GLib.timeout_add(2000, self.update_status, "", False)
 
     def on_take_photo(self, widget):
-        """Photo capture disabled - causes camera conflicts"""
-        self.update_status("Photo capture disabled (causes camera issues)", show_spinner=False)
+        """Capture a photo from the running camera session"""
+        if self.controller.capture_still():
+            self.log_message("Photo requested")
+        else:
+            self.update_status("Camera is not streaming yet", show_spinner=False)
+            GLib.timeout_add(2000, self.update_status, "", False)
+
+    def on_photo_saved(self, path, error):
+        """Called on the main loop once a photo has been written (or failed)"""
+        if error:
+            self.log_message(f"Photo capture failed: {error}")
+            self.update_status(f"Photo capture failed: {error}", show_spinner=False)
+        else:
+            self.log_message(f"Photo saved: {path}")
+            self.update_status(f"📸 Saved {os.path.basename(path)}", show_spinner=False)
         GLib.timeout_add(2000, self.update_status, "", False)
-        self.log_message("Photo capture attempted but disabled")
+        return False
 
     def on_open_folder(self, widget):
         """Open photos folder"""
@@ -593,34 +1072,20 @@ class SurfaceCameraApp(Gtk.Window):
     def on_destroy(self, widget):
         self.log_message("Application closing...")
 
-        # Clean up GStreamer resources properly
-        if self.pipeline:
-            try:
-                # Stop the pipeline and wait for it to fully stop
-                self.log_message("Stopping pipeline...")
-                self.pipeline.set_state(Gst.State.NULL)
-                ret, state, pending = self.pipeline.get_state(5 * Gst.SECOND)
-                if ret == Gst.StateChangeReturn.SUCCESS:
-                    self.log_message("Pipeline stopped successfully")
-                else:
-                    self.log_message(f"Pipeline stop returned: {ret}")
-            except Exception as e:
-                self.log_message(f"Error stopping pipeline on exit: {e}")
-
-        # Remove bus signal watch to prevent memory leaks
-        if self.bus:
+        # Keep the numbers from a traced session for offline comparison
+        if TRACING:
             try:
-                self.bus.remove_signal_watch()
-                self.log_message("Bus signal watch removed on exit")
+                self.log_message(f"Performance stats exported to {self.perf.export()}")
             except Exception as e:
-                self.log_message(f"Error removing bus watch: {e}")
-            self.bus = None
+                self.log_message(f"Could not export stats: {e}")
 
-        # Clear pipeline reference
-        self.pipeline = None
+        # Clean up GStreamer resources properly
+        self.controller.shutdown()
+        if self.replay:
+            self.replay.close()
+            self.replay = None
 
         # Force garbage collection before exit
-        import gc
         gc.collect()
         self.log_message("Resources cleaned up, exiting...")
 
@@ -0,0 +1,334 @@
+#!/usr/bin/python3
+"""
+Record and replay raw Surface Pro 9 camera streams
+
+Records the raw libcamerasrc output of either sensor to a frame file and
+replays it through an appsrc, so the Howdy reader and the camera app preview
+can be benchmarked on real image content without a Surface.
+
+File layout (little endian):
+    header  HEADER_SIZE bytes: magic, version, frame size, frame count,
+            index offset and the negotiated caps string (NUL padded)
+    frames  frame_count * frame_size bytes, back to back
+    index   frame_count uint64 buffer timestamps in nanoseconds
+
+Usage:
+    surface_replay.py record front -o front.raw -n 300
+    surface_replay.py info front.raw
+"""
+import argparse
+import mmap
+import os
+import struct
+import sys
+import time
+
+# CRITICAL: Set environment to use locally built libcamera 0.6.0 instead of system 0.2.0
+# setdefault so an importing app that already configured the paths keeps them
+os.environ.setdefault('GST_PLUGIN_PATH', '/usr/local/lib/x86_64-linux-gnu/gstreamer-1.0')
+if '/usr/local/lib/x86_64-linux-gnu' not in os.environ.get('LD_LIBRARY_PATH', ''):
+    os.environ['LD_LIBRARY_PATH'] = '/usr/local/lib/x86_64-linux-gnu:' + os.environ.get('LD_LIBRARY_PATH', '')
+
+import gi
+gi.require_version('Gst', '1.0')
+from gi.repository import Gst
+
+MAGIC = b"SPCRAW01"
+VERSION = 1
+
+# magic, version, frame size, frame count, index offset
+HEADER = struct.Struct("<8sIQQQ")
+
+# Page aligned so the first frame starts on a page boundary in the map
+HEADER_SIZE = 4096
+CAPS_SIZE = HEADER_SIZE - HEADER.size
+
+# Largest recording ReplaySource copies into memory (1 GiB, about 1100
+# 640x480 NV12 frames or 360 at 1280x720)
+MAX_PRELOAD = 1 << 30
+
+# Double backslash so Gst.parse_launch() receives a single one
+CAMERAS = {
+    "front": "\\\\_SB_.PC00.I2C3.CAMF",
+    "rear": "\\\\_SB_.PC00.I2C2.CAMR",
+}
+
+
+class RawFrameWriter:
+    """Writes fixed-size frames and their timestamps to a frame file"""
+
+    def __init__(self, path, caps):
+        caps = caps.encode()
+        if len(caps) >= CAPS_SIZE:
+            raise ValueError(f"Caps string too long for header ({len(caps)} bytes)")
+
+        self.path = path
+        self.caps = caps
+        self.frame_size = None
+        self.timestamps = []
+        self.file = open(path, "wb")
+        self.file.write(b"\0" * HEADER_SIZE)  # Rewritten by close()
+
+    def write(self, data, pts):
+        """Append one frame; every frame must have the size of the first"""
+        if self.frame_size is None:
+            self.frame_size = len(data)
+        elif len(data) != self.frame_size:
+            raise ValueError(f"Frame {len(self.timestamps)} is {len(data)} bytes, expected {self.frame_size}")
+
+        self.file.write(data)
+        self.timestamps.append(pts)
+
+    def close(self):
+        """Write the timestamp index and the final header"""
+        if self.file is None:
+            return
+
+        index_offset = self.file.tell()
+        self.file.write(struct.pack(f"<{len(self.timestamps)}Q", *self.timestamps))
+
+        self.file.seek(0)
+        self.file.write(HEADER.pack(MAGIC, VERSION, self.frame_size or 0,
+                                    len(self.timestamps), index_offset))
+        self.file.write(self.caps.ljust(CAPS_SIZE, b"\0"))
+        self.file.close()
+        self.file = None
+
+
+class RawFrameFile:
+    """Read-only memory map of a frame file"""
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size < HEADER_SIZE:
+                raise ValueError(f"{path} is too short to be a raw frame recording")
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, self.frame_size, self.frame_count, index_offset = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC:
+            self.map.close()
+            raise ValueError(f"{path} is not a raw frame recording")
+        if version != VERSION:
+            self.map.close()
+            raise ValueError(f"{path} has unsupported version {version}")
+        if (HEADER_SIZE + self.frame_count * self.frame_size > index_offset
+                or index_offset + 8 * self.frame_count > len(self.map)):
+            self.map.close()
+            raise ValueError(f"{path} is truncated")
+
+        self.caps = self.map[HEADER.size:HEADER_SIZE].rstrip(b"\0").decode()
+        self.timestamps = struct.unpack_from(f"<{self.frame_count}Q", self.map, index_offset)
+
+        # Fault the whole file in ahead of time rather than on first access
+        if hasattr(self.map, "madvise"):
+            self.map.madvise(mmap.MADV_WILLNEED)
+
+    def frame(self, index):
+        """Zero-copy view of the frame at index in the map (no file I/O)"""
+        start = HEADER_SIZE + index * self.frame_size
+        return memoryview(self.map)[start:start + self.frame_size]
+
+    def duration(self):
+        """Recorded duration in nanoseconds"""
+        if self.frame_count < 2:
+            return 0
+        return self.timestamps[-1] - self.timestamps[0]
+
+    def frame_interval(self):
+        """Nanoseconds between frames, from the timestamps or the caps framerate"""
+        if self.frame_count >= 2:
+            return self.duration() // (self.frame_count - 1)
+        ok, num, den = Gst.Caps.from_string(self.caps).get_structure(0).get_fraction("framerate")
+        if ok and num > 0:
+            return Gst.SECOND * den // num
+        return Gst.SECOND // 30
+
+    def close(self):
+        self.map.close()
+
+
+def is_recording(path):
+    """True if path is a raw frame recording"""
+    try:
+        with open(path, "rb") as f:
+            return f.read(len(MAGIC)) == MAGIC
+    except OSError:
+        return False
+
+
+class ReplaySource:
+    """
+    Serves a recording through an appsrc in place of libcamerasrc.
+
+    Every frame is copied out of the memory map into a Gst.Buffer once, when
+    the source is created, and recordings over max_preload bytes are
+    refused. Each push is then a shallow copy that shares the frame memory,
+    which keeps copy cost out of the read-path measurements. With realtime=True each frame is
+    held back until its recorded offset from the first frame and stamped by
+    the appsrc clock. Otherwise frames are pushed as fast as downstream
+    accepts them, with their recorded timestamps.
+
+    One source can feed successive pipelines: attach() it to each new appsrc.
+    """
+
+    def __init__(self, path, realtime=True, loop=False, max_preload=MAX_PRELOAD):
+        self.recording = RawFrameFile(path)
+        size = self.recording.frame_count * self.recording.frame_size
+        if size > max_preload:
+            self.recording.close()
+            raise ValueError(f"{path} has {size / 2**20:.0f} MiB of frames, replay loads at most "
+                             f"{max_preload / 2**20:.0f} MiB; record fewer frames or a smaller size")
+        self.realtime = realtime
+        self.loop = loop
+        self.interval = self.recording.frame_interval()
+        self.buffers = [Gst.Buffer.new_wrapped(bytes(self.recording.frame(i)))
+                        for i in range(self.recording.frame_count)]
+        self.appsrc = None
+        self.index = 0
+        self.loop_offset = 0
+        self.start_time = None
+
+    def description(self, name="src"):
+        """gst-launch description of the appsrc for this recording"""
+        if self.realtime:
+            timing = "is-live=true do-timestamp=true"
+        else:
+            timing = "is-live=false"
+        return f"appsrc name={name} format=time {timing}"
+
+    def attach(self, appsrc):
+        """Start feeding an appsrc created from description()"""
+        # Set as an object rather than inline, recorded caps may contain quotes
+        appsrc.set_property("caps", Gst.Caps.from_string(self.recording.caps))
+        self.appsrc = appsrc
+        self.index = 0
+        self.loop_offset = 0
+        self.start_time = None
+        appsrc.connect("need-data", self._on_need_data)
+
+    def _on_need_data(self, appsrc, length):
+        """Push the next frame (runs on the appsrc streaming thread)"""
+        if appsrc is not self.appsrc:
+            return  # A previous pipeline that is being torn down
+
+        recording = self.recording
+        if self.index >= recording.frame_count:
+            if not self.loop or recording.frame_count == 0:
+                appsrc.emit("end-of-stream")
+                return
+            # Continue one frame interval after the last frame
+            self.loop_offset += recording.duration() + self.interval
+            self.index = 0
+
+        offset = recording.timestamps[self.index] - recording.timestamps[0] + self.loop_offset
+
+        # Shallow copy: new metadata (timestamps), shared frame memory
+        buffer = self.buffers[self.index].copy()
+        if self.realtime:
+            if self.start_time is None:
+                self.start_time = time.monotonic()
+            delay = self.start_time + offset / Gst.SECOND - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        else:
+            buffer.pts = offset
+
+        self.index += 1
+        appsrc.emit("push-buffer", buffer)
+
+    def close(self):
+        self.appsrc = None
+        self.buffers = []
+        self.recording.close()
+
+
+def record(camera, path, count, width=None, height=None, timeout=5.0):
+    """Record count raw frames from camera ("front" or "rear") to path"""
+    Gst.init(None)
+
+    caps = "video/x-raw"
+    if width and height:
+        caps += f",width={width},height={height}"
+
+    # No flip or conversion - replay feeds the same chain as the live source
+    cmd = (f'libcamerasrc camera-name="{CAMERAS[camera]}" ! {caps} ! '
+           "appsink name=sink sync=false max-buffers=64 drop=false")
+    print(f"Pipeline: {cmd}")
+    pipeline = Gst.parse_launch(cmd)
+    appsink = pipeline.get_by_name("sink")
+
+    if pipeline.set_state(Gst.State.PLAYING) == Gst.StateChangeReturn.FAILURE:
+        raise RuntimeError("Failed to start GStreamer pipeline")
+
+    writer = None
+    try:
+        for index in range(count):
+            sample = appsink.emit("try-pull-sample", int(timeout * Gst.SECOND))
+            if not sample:
+                raise RuntimeError(f"Timed out waiting for frame {index}")
+
+            if writer is None:
+                writer = RawFrameWriter(path, sample.get_caps().to_string())
+
+            buffer = sample.get_buffer()
+            success, map_info = buffer.map(Gst.MapFlags.READ)
+            if not success:
+                raise RuntimeError(f"Failed to map frame {index}")
+            try:
+                writer.write(map_info.data, buffer.pts if buffer.pts != Gst.CLOCK_TIME_NONE else 0)
+            finally:
+                buffer.unmap(map_info)
+    finally:
+        pipeline.set_state(Gst.State.NULL)
+        pipeline.get_state(5 * Gst.SECOND)
+        if writer:
+            writer.close()
+
+    return writer
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Record and inspect raw camera frame files")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    rec = subparsers.add_parser("record", help="Record a raw libcamerasrc stream")
+    rec.add_argument("camera", choices=sorted(CAMERAS))
+    rec.add_argument("-o", "--output", required=True)
+    rec.add_argument("-n", "--frames", type=int, default=300, help="Frames to record (default: 300)")
+    rec.add_argument("--width", type=int, help="Requested width (640 for Howdy, 1280 for the app)")
+    rec.add_argument("--height", type=int, help="Requested height (480 for Howdy, 720 for the app)")
+
+    info = subparsers.add_parser("info", help="Describe a recording")
+    info.add_argument("path")
+
+    args = parser.parse_args()
+
+    if args.command == "record":
+        if args.frames < 1:
+            parser.error("--frames must be at least 1")
+        try:
+            writer = record(args.camera, args.output, args.frames, args.width, args.height)
+        except RuntimeError as e:
+            print(f"Recording failed: {e}", file=sys.stderr)
+            return 1
+        print(f"Recorded {len(writer.timestamps)} frames of {writer.frame_size} bytes to {args.output}")
+        return 0
+
+    try:
+        recording = RawFrameFile(args.path)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        return 1
+    duration = recording.duration() / Gst.SECOND
+    print(f"Caps:     {recording.caps}")
+    print(f"Frames:   {recording.frame_count} x {recording.frame_size} bytes")
+    print(f"Duration: {duration:.2f}s")
+    if duration > 0:
+        print(f"Rate:     {(recording.frame_count - 1) / duration:.2f} fps")
+    recording.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,44 @@
+"""
+Thread sizing for the Surface Pro 9 camera pipelines
+
+Shared by the camera app, the burst and benchmark tools and the Howdy
+GStreamer reader (installed next to it by install-howdy-gstreamer.sh).
+"""
+import glob
+import os
+
+
+def available_cores():
+    """Cores this process may run on (respects taskset/cgroup affinity)"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def conversion_threads():
+    """
+    Worker threads for videoconvert: every available core on AC power,
+    half of them on battery or in the low-power platform profile
+    """
+    cores = available_cores()
+
+    power_saving = False
+    try:
+        with open("/sys/firmware/acpi/platform_profile") as f:
+            power_saving = f.read().strip() == "low-power"
+    except OSError:
+        pass
+
+    for supply in glob.glob("/sys/class/power_supply/*"):
+        try:
+            with open(os.path.join(supply, "type")) as f:
+                if f.read().strip() != "Mains":
+                    continue
+            with open(os.path.join(supply, "online")) as f:
+                if f.read().strip() == "0":
+                    power_saving = True
+        except OSError:
+            continue
+
+    return max(1, cores // 2) if power_saving else cores
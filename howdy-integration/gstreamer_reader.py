@@ -17,6 +17,21 @@ gi.require_version('Gst', '1.0')
 from gi.repository import Gst
 import numpy as np
 
+# Shared camera-fix modules: installed next to this file by
+# install-howdy-gstreamer.sh, or found in ../camera-fix on a checkout.
+# Appended so nothing in these directories shadows Howdy's own imports.
+_here = os.path.dirname(os.path.abspath(__file__))
+for _path in (_here, os.path.join(_here, '..', 'camera-fix')):
+    if os.path.isdir(_path) and _path not in sys.path:
+        sys.path.append(_path)
+
+try:
+    from surface_threads import conversion_threads
+except ImportError:
+    # Face login must keep working with only this file updated
+    def conversion_threads():
+        return os.cpu_count() or 1
+
 
 class gstreamer_reader:
     """
@@ -24,13 +39,26 @@ class gstreamer_reader:
     Opens the camera only when Howdy needs it, closes when done.
     """
 
-    def __init__(self, device_path, camera_name='\\_SB_.PC00.I2C3.CAMF'):
+    def __init__(self, device_path, camera_name='\\_SB_.PC00.I2C3.CAMF', replay_realtime=None,
+                 still_stream=False):
         """
         Initialize GStreamer pipeline for libcamera
 
         Args:
-            device_path: Not used (kept for compatibility with Howdy)
+            device_path: Not used for the camera (kept for compatibility with
+                         Howdy). If it points to a surface_replay.py recording,
+                         frames are replayed from that file instead.
             camera_name: The libcamera camera name (ACPI path)
+            replay_realtime: Replay at the recorded timing (default) or as fast
+                             as possible. Defaults to the
+                             GSTREAMER_READER_REPLAY_TIMING environment variable
+                             ("realtime" or "fast").
+            still_stream: Also open a full-resolution still-capture stream in
+                          the same libcamera session, for read_still(). Off
+                          by default: libcamera fills the full-resolution
+                          buffers on every request and may switch the sensor
+                          to a slower full-resolution mode, which face
+                          detection does not need.
         """
         # Initialize GStreamer
         Gst.init(None)
@@ -41,21 +69,92 @@ class gstreamer_reader:
         self.pipeline = None
         self.appsink = None
         self.bus = None
+        self.still_valve = None
+        self.still_sink = None
+        self._still_probe = None
+        self._streams_rejected = False
+
+        # Replay a raw recording in place of the camera (benchmarking)
+        self.replay = None
+        if device_path and self._is_recording(device_path):
+            if replay_realtime is None:
+                replay_realtime = os.environ.get('GSTREAMER_READER_REPLAY_TIMING', 'realtime') != 'fast'
+            self.replay = self._open_replay(device_path, replay_realtime)
+
+        # Frame layout (height, width, channels, row stride) and the caps it
+        # was parsed from. Every sample carries its caps; while they are the
+        # same caps object the per-frame path never touches the structure.
+        self._frame_caps = None
+        self._frame_layout = None
 
         # Build the pipeline
-        self._create_pipeline()
+        self.still_stream = still_stream and self.replay is None
+        try:
+            self._create_pipeline()
+        except Exception:
+            if not (self.still_stream and self._streams_rejected):
+                raise
+            # Not every libcamera pipeline handler can run two streams at once
+            print("[WARNING] libcamera rejected the two-stream configuration, "
+                  "retrying with the viewfinder stream only")
+            self._stop_pipeline()
+            self.still_stream = False
+            self._create_pipeline()
+
+    @staticmethod
+    def _is_recording(path):
+        """True if path is a recording made with surface_replay.py"""
+        if not os.path.isfile(path):
+            return False  # Device nodes and camera names, skip the import
+        from surface_replay import is_recording
+        return is_recording(path)
+
+    def _open_replay(self, path, realtime):
+        """Open a recording made with surface_replay.py"""
+        from surface_replay import ReplaySource
+
+        print(f"[DEBUG] Replaying {path} ({'realtime' if realtime else 'as fast as possible'})")
+        return ReplaySource(path, realtime=realtime)
 
     def _create_pipeline(self):
         """Create the GStreamer pipeline"""
         # Pipeline: libcamera source -> videoflip -> convert -> appsink
         # Note: Using default camera (first one) as camera-name with backslash causes issues
+        # Live frames are dropped if Howdy falls behind
+        drop = 'true'
+        if self.replay:
+            # A recording carries its own fixed caps
+            source = f"{self.replay.description('src')} ! "
+            if not self.replay.realtime:
+                # Deterministic benchmarks: every recorded frame reaches read()
+                drop = 'false'
+        elif self.still_stream:
+            # One libcamera session with two streams: the small viewfinder
+            # stream feeds detection, and a still-capture stream at the sensor's
+            # full resolution is dropped at the valve until read_still()
+            source = (
+                f"libcamerasrc name=src "
+                f"src::stream-role=view-finder src_0::stream-role=still-capture "
+                f"src.src_0 ! valve name=still_valve drop=true ! "
+                f"queue max-size-buffers=1 ! "
+                f"videoflip method=rotate-180 ! "
+                f"videoconvert n-threads={conversion_threads()} ! "
+                f"video/x-raw,format=BGR ! "
+                f"appsink name=still_sink sync=false async=false max-buffers=1 drop=true "
+                f"src.src ! "
+                f"video/x-raw,width={self.width},height={self.height},framerate=30/1 ! "
+            )
+        else:
+            source = (
+                f"libcamerasrc ! "
+                f"video/x-raw,width={self.width},height={self.height},framerate=30/1 ! "
+            )
         pipeline_str = (
-            f"libcamerasrc ! "
-            f"video/x-raw,width={self.width},height={self.height},framerate=30/1 ! "
+            source +
             f"videoflip method=rotate-180 ! "
-            f"videoconvert ! "
+            f"videoconvert n-threads={conversion_threads()} ! "
             f"video/x-raw,format=BGR ! "
-            f"appsink name=sink emit-signals=true sync=false max-buffers=1 drop=true"
+            f"appsink name=sink emit-signals=true sync=false max-buffers=1 drop={drop}"
         )
 
         try:
@@ -63,6 +162,11 @@ class gstreamer_reader:
             print(f"[DEBUG] Pipeline string: {pipeline_str}")
             self.pipeline = Gst.parse_launch(pipeline_str)
             self.appsink = self.pipeline.get_by_name('sink')
+            if self.replay:
+                self.replay.attach(self.pipeline.get_by_name('src'))
+            if self.still_stream:
+                self.still_valve = self.pipeline.get_by_name('still_valve')
+                self.still_sink = self.pipeline.get_by_name('still_sink')
             self.bus = self.pipeline.get_bus()
             self.bus.add_signal_watch()
 
@@ -78,6 +182,7 @@ class gstreamer_reader:
                     err, debug = msg.parse_error()
                     print(f"[ERROR] GStreamer error: {err.message}")
                     print(f"[DEBUG] {debug}")
+                    self._streams_rejected = self._rejects_streams(msg.src, err, debug)
                     raise RuntimeError(f"GStreamer error: {err.message}")
                 else:
                     print("[ERROR] Failed to start pipeline - no error message available")
@@ -95,6 +200,7 @@ class gstreamer_reader:
                     err, debug = msg.parse_error()
                     print(f"[ERROR] GStreamer error: {err.message}")
                     print(f"[DEBUG] {debug}")
+                    self._streams_rejected = self._rejects_streams(msg.src, err, debug)
                     raise RuntimeError(f"GStreamer error: {err.message}")
                 print("[DEBUG] Pipeline ready!")
             else:
@@ -104,6 +210,65 @@ class gstreamer_reader:
             print(f"Failed to create GStreamer pipeline: {e}")
             raise
 
+    def _rejects_streams(self, src, err, debug):
+        """
+        True if libcamerasrc refused the view-finder + still-capture pair:
+        it reports an unsupported or failed configuration as a settings
+        error, and caps it cannot satisfy as not-negotiated
+        """
+        if not self.still_stream or src != self.pipeline.get_by_name('src'):
+            return False
+        return (err.matches(Gst.resource_error_quark(), Gst.ResourceError.SETTINGS)
+                or 'not-negotiated' in (debug or ''))
+
+    @staticmethod
+    def _parse_layout(caps):
+        """Return (height, width, channels, stride) of BGR caps"""
+        structure = caps.get_structure(0)
+        width = structure.get_value('width')
+        height = structure.get_value('height')
+        # BGR rows are padded to 4 bytes by GStreamer
+        stride = (width * 3 + 3) & ~3
+        return (height, width, 3, stride)
+
+    def _get_frame_layout(self, sample):
+        """
+        Return (height, width, channels, stride) for a viewfinder sample.
+        Caps are only parsed on the first sample after a negotiation.
+        """
+        caps = sample.get_caps()
+        # is_equal() returns at once for the same caps pointer
+        if self._frame_caps is None or not caps.is_equal(self._frame_caps):
+            self._frame_layout = self._parse_layout(caps)
+            self._frame_caps = caps
+        return self._frame_layout
+
+    def _copy_frame(self, sample, out, layout=None):
+        """
+        Copy the frame in a sample into a preallocated (H, W, C) array
+
+        Returns:
+            True if the buffer could be mapped and copied
+        """
+        height, width, channels, stride = layout or self._get_frame_layout(sample)
+        buffer = sample.get_buffer()
+
+        success, map_info = buffer.map(Gst.MapFlags.READ)
+        if not success:
+            return False
+
+        try:
+            rows = np.ndarray(
+                shape=(height, stride),
+                dtype=np.uint8,
+                buffer=map_info.data
+            )
+            out[...] = rows[:, :width * channels].reshape(height, width, channels)
+        finally:
+            buffer.unmap(map_info)
+
+        return True
+
     def read(self):
         """
         Read a frame from the camera
@@ -119,32 +284,102 @@ class gstreamer_reader:
         if not sample:
             return False, None
 
-        # Get the buffer and caps from the sample
-        buffer = sample.get_buffer()
-        caps = sample.get_caps()
+        layout = self._get_frame_layout(sample)
+        frame = np.empty(layout[:3], dtype=np.uint8)
+        if not self._copy_frame(sample, frame, layout):
+            return False, None
 
-        # Extract frame dimensions from caps
-        structure = caps.get_structure(0)
-        width = structure.get_value('width')
-        height = structure.get_value('height')
+        return True, frame
 
-        # Map the buffer to numpy array
-        success, map_info = buffer.map(Gst.MapFlags.READ)
-        if not success:
+    def read_batch(self, n, timeout=1.0, out=None):
+        """
+        Read n consecutive frames into one contiguous array
+
+        Args:
+            n: Number of frames to read
+            timeout: Maximum seconds to wait for each frame
+            out: Optional preallocated (n, H, W, 3) uint8 array to fill.
+                 Reusing it across calls avoids a large allocation per batch.
+
+        Returns:
+            (count, frames, timestamps): Number of frames read, the
+            (n, H, W, 3) BGR array (None if nothing arrived and out was not
+            given) and an int64 array of buffer timestamps in nanoseconds
+            (-1 when unknown). Only the first count entries are valid; count
+            is less than n if a frame timed out or the layout changed.
+        """
+        timestamps = np.full(n, -1, dtype=np.int64)
+        if not self.pipeline:
+            return 0, out, timestamps
+
+        timeout_ns = int(timeout * Gst.SECOND)
+        frames = out
+        count = 0
+
+        while count < n:
+            sample = self.appsink.emit('try-pull-sample', timeout_ns)
+            if not sample:
+                break
+
+            layout = self._get_frame_layout(sample)
+            height, width, channels, _ = layout
+            if frames is None:
+                frames = np.empty((n, height, width, channels), dtype=np.uint8)
+            elif frames.shape[1:] != (height, width, channels):
+                # Caps were renegotiated mid-batch; stop rather than mix sizes
+                break
+
+            if not self._copy_frame(sample, frames[count], layout):
+                break
+
+            pts = sample.get_buffer().pts
+            if pts != Gst.CLOCK_TIME_NONE:
+                timestamps[count] = pts
+            count += 1
+
+        return count, frames, timestamps
+
+    def read_still(self, timeout=2.0):
+        """
+        Read one full-resolution frame from the still-capture stream.
+        The camera session is not reconfigured or restarted.
+
+        Returns:
+            (success, frame): Tuple of success boolean and BGR numpy array
+        """
+        if not self.pipeline or not self.still_valve:
             return False, None
 
-        # Create numpy array from buffer data
-        frame = np.ndarray(
-            shape=(height, width, 3),
-            dtype=np.uint8,
-            buffer=map_info.data
-        )
+        # A frame that arrived after an earlier call timed out is stale
+        self.still_sink.emit('try-pull-sample', 0)
+
+        # Let one buffer through: the probe closes the valve again from
+        # inside the valve's chain, before the next buffer arrives
+        pad = self.still_valve.get_static_pad('src')
+        self._still_probe = pad.add_probe(Gst.PadProbeType.BUFFER, self._on_still_passed)
+        self.still_valve.set_property('drop', False)
+        sample = self.still_sink.emit('try-pull-sample', int(timeout * Gst.SECOND))
+        self.still_valve.set_property('drop', True)
+        if self._still_probe is not None:
+            # No buffer reached the valve, don't leave the probe for the next call
+            pad.remove_probe(self._still_probe)
+            self._still_probe = None
+        if not sample:
+            return False, None
 
-        # Unmap the buffer
-        buffer.unmap(map_info)
+        layout = self._parse_layout(sample.get_caps())
+        frame = np.empty(layout[:3], dtype=np.uint8)
+        if not self._copy_frame(sample, frame, layout):
+            return False, None
 
         return True, frame
 
+    def _on_still_passed(self, pad, info):
+        """Pad probe on the still valve (streaming thread)"""
+        self._still_probe = None
+        pad.get_parent_element().set_property('drop', True)
+        return Gst.PadProbeReturn.REMOVE
+
     def grab(self):
         """
         Grab a frame (compatibility method for OpenCV API)
@@ -166,13 +401,23 @@ class gstreamer_reader:
         # but we use fixed 640x480 for Howdy
         pass
 
-    def release(self):
-        """Release the camera and cleanup resources"""
+    def _stop_pipeline(self):
+        """Stop the pipeline and drop element references"""
         if self.pipeline:
             self.pipeline.set_state(Gst.State.NULL)
             self.pipeline = None
             self.appsink = None
             self.bus = None
+            self.still_valve = None
+            self.still_sink = None
+            self._still_probe = None
+
+    def release(self):
+        """Release the camera and cleanup resources"""
+        self._stop_pipeline()
+        if self.replay:
+            self.replay.close()
+            self.replay = None
 
     def __del__(self):
         """Cleanup on deletion"""
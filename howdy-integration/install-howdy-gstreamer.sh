@@ -41,6 +41,14 @@ echo "[2/4] Installing GStreamer recorder..."
 cp "$SCRIPT_DIR/gstreamer_reader.py" /usr/lib/security/howdy/recorders/
 chmod 644 /usr/lib/security/howdy/recorders/gstreamer_reader.py
 
+# Shared thread sizing helper (required by the recorder)
+cp "$SCRIPT_DIR/../camera-fix/surface_threads.py" /usr/lib/security/howdy/recorders/
+chmod 644 /usr/lib/security/howdy/recorders/surface_threads.py
+
+# Replay support for benchmarking with recorded frames (optional at runtime)
+cp "$SCRIPT_DIR/../camera-fix/surface_replay.py" /usr/lib/security/howdy/recorders/
+chmod 644 /usr/lib/security/howdy/recorders/surface_replay.py
+
 # Patch video_capture.py to recognize the gstreamer plugin
 "$SCRIPT_DIR/scripts/howdy/patch-howdy-video-capture.sh"
 
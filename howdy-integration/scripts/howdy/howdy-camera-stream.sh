@@ -33,7 +33,7 @@ gst-launch-1.0 -q libcamerasrc camera-name='\_SB_.PC00.I2C3.CAMF' \
     ! queue \
     ! video/x-raw,width=640,height=480,framerate=30/1 \
     ! videoflip method=rotate-180 \
-    ! videoconvert \
+    ! videoconvert n-threads=$(nproc) \
     ! video/x-raw,format=BGR \
     ! v4l2sink device=/dev/video33 &
 